@@ -15,8 +15,13 @@ Usage:
 
 import asyncio
 import logging
-import re
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
 
+from cachetools import TTLCache
 from telegram import Update, InputFile
 from telegram.ext import (
     Application,
@@ -24,9 +29,14 @@ from telegram.ext import (
     ContextTypes,
 )
 
-from config import TELEGRAM_BOT_TOKEN, TOKEN_TICKER, TOKEN_NAME, TOKEN_MINT
-from solana_client import get_wallet_data, get_token_price
-from card_generator import generate_flex_card
+from config import (
+    TELEGRAM_BOT_TOKEN, TOKEN_TICKER, TOKEN_NAME, TOKEN_MINT,
+    WEBHOOK_URL, WEBHOOK_PORT, WEBHOOK_SECRET,
+)
+from solana_client import get_wallet_data, get_token_price, close_client
+from card_generator import (
+    card_cache, card_timestamp, flex_card_key, render_flex_card, log_pillow_build,
+)
 
 # Logging
 logging.basicConfig(
@@ -35,12 +45,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Simple rate limiting (wallet -> last request timestamp)
-_rate_limit: dict[str, float] = {}
-RATE_LIMIT_SECONDS = 15  # one flex per wallet per 15s
+# Simple rate limiting ((chat_id, wallet) -> last request timestamp), stale entries expire
+RATE_LIMIT_SECONDS = 15  # one flex per wallet per chat per 15s
+_rate_limit: TTLCache = TTLCache(maxsize=10_000, ttl=RATE_LIMIT_SECONDS * 2)
+
+# Card rendering is CPU-bound Pillow work; run it in worker processes (created in main())
+_RENDER_POOL: ProcessPoolExecutor | None = None
+
+# Solana address alphabet (base58: no 0, O, I or l)
+_B58 = frozenset("123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz")
+
+
+def _valid_wallet(wallet: str) -> bool:
+    """Check a Solana address is 32-44 base58 characters."""
+    return 32 <= len(wallet) <= 44 and _B58.issuperset(wallet)
+
 
-# Solana address regex (base58, 32-44 chars)
-SOLANA_ADDR_RE = re.compile(r"^[1-9A-HJ-NP-Za-km-z]{32,44}$")
+def _new_render_pool() -> ProcessPoolExecutor:
+    """Start render workers with spawn, so they don't fork the running event loop."""
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+async def _render_card(data, timestamp: str) -> bytes:
+    """Render a card in the pool, replacing the pool once if a worker died."""
+    global _RENDER_POOL
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = _RENDER_POOL
+        try:
+            return await loop.run_in_executor(pool, render_flex_card, data, timestamp)
+        except BrokenProcessPool as e:
+            if attempt:
+                raise RuntimeError("Card renderer is unavailable, try again shortly.") from e
+            logger.warning("Render pool broke (worker died); starting a new one")
+            # Concurrent flexes may hit the same broken pool; only replace it once
+            if _RENDER_POOL is pool:
+                _RENDER_POOL = _new_render_pool()
+                pool.shutdown(wait=False, cancel_futures=True)
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -113,7 +157,7 @@ async def flex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     wallet = context.args[0].strip()
 
     # Validate address format
-    if not SOLANA_ADDR_RE.match(wallet):
+    if not _valid_wallet(wallet):
         await message.reply_text(
             "❌ That doesn't look like a valid Solana wallet address.\n"
             "It should be 32-44 characters of base58 (letters and numbers, no 0/O/I/l)."
@@ -122,11 +166,13 @@ async def flex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Rate limit check
     now = time.time()
-    if wallet in _rate_limit and now - _rate_limit[wallet] < RATE_LIMIT_SECONDS:
-        remaining = int(RATE_LIMIT_SECONDS - (now - _rate_limit[wallet]))
+    rate_key = (message.chat_id, wallet)
+    last = _rate_limit.get(rate_key)
+    if last is not None and now - last < RATE_LIMIT_SECONDS:
+        remaining = int(RATE_LIMIT_SECONDS - (now - last))
         await message.reply_text(f"⏳ Cooldown! Try again in {remaining}s.")
         return
-    _rate_limit[wallet] = now
+    _rate_limit[rate_key] = now
 
     # Send "generating" message
     status_msg = await message.reply_text(
@@ -139,32 +185,40 @@ async def flex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Fetch all wallet data
         logger.info(f"Fetching wallet data for {wallet}")
         data = await get_wallet_data(wallet)
-        logger.info(f"Wallet data: balance={data.get('balance')}, usd={data.get('usd_value')}")
+        logger.info(f"Wallet data: balance={data.balance}, usd={data.usd_value}")
 
         # Check if they actually hold any tokens
-        if data["balance"] is None:
+        if data.balance is None:
             await status_msg.edit_text(
                 "❌ Couldn't read wallet data. Check the address and try again."
             )
             return
 
-        if data["balance"] == 0:
+        if data.balance == 0:
             await status_msg.edit_text(
                 f"😢 This wallet doesn't hold any {TOKEN_TICKER}!\n\n"
                 f"Buy some $BERT first, then come back to flex. 🐶"
             )
             return
 
-        # Generate the card
-        logger.info("Generating flex card image...")
-        card_image = generate_flex_card(data)
-        logger.info(f"Card generated, size={card_image.getbuffer().nbytes} bytes")
+        # Generate the card (off the event loop so other commands keep flowing)
+        # The cache lives here; only misses pay for a round trip to the render pool
+        timestamp = card_timestamp()
+        key = flex_card_key(data, timestamp)
+        card_jpg = card_cache.get(key)
+        if card_jpg is None:
+            logger.info("Generating flex card image...")
+            card_jpg = await _render_card(data, timestamp)
+            card_cache[key] = card_jpg
+            logger.info(f"Card generated, size={len(card_jpg)} bytes")
+        else:
+            logger.info("Using cached flex card image")
 
         # Build caption
         caption = (
-            f"🐶 <b>{TOKEN_TICKER} FLEX</b> by {data['wallet_short']}\n\n"
-            f"💰 {data['balance_formatted']} BERT (≈ {data['usd_value_formatted']})\n"
-            f"💎 Holding for: {data['hold_duration']}\n\n"
+            f"🐶 <b>{TOKEN_TICKER} FLEX</b> by {data.wallet_short}\n\n"
+            f"💰 {data.balance_str} BERT (≈ {data.usd_str})\n"
+            f"💎 Holding for: {data.hold_duration}\n\n"
             f"<i>Flex your bag → /flex</i>"
         )
 
@@ -177,7 +231,7 @@ async def flex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Send the flex card
         logger.info("Sending photo to Telegram...")
         await message.reply_photo(
-            photo=InputFile(card_image, filename="bert_flex_card.png"),
+            photo=InputFile(BytesIO(card_jpg), filename="bert_flex_card.jpg"),
             caption=caption,
             parse_mode="HTML",
         )
@@ -201,7 +255,7 @@ async def handle_error(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def main():
     """Start the bot."""
-    import asyncio
+    global _RENDER_POOL
 
     if not TELEGRAM_BOT_TOKEN:
         print("❌ ERROR: Set TELEGRAM_BOT_TOKEN in .env file!")
@@ -210,11 +264,21 @@ def main():
         print("   3. Copy the token to .env")
         return
 
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        print("❌ ERROR: WEBHOOK_URL is set but WEBHOOK_SECRET is empty!")
+        print("   The secret is the webhook path and Telegram's secret token,")
+        print("   so without it anyone could post fake updates to the bot.")
+        print("   Set WEBHOOK_SECRET in .env (letters, digits, _ and - only),")
+        print("   or remove WEBHOOK_URL to use long polling.")
+        return
+
     print(f"🐶 Starting {TOKEN_TICKER} Flex Bot...")
     print(f"   Token: {TOKEN_NAME}")
     print(f"   Mint:  {TOKEN_MINT}")
+    log_pillow_build()
 
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Process updates concurrently so a slow /flex doesn't hold up /price or /start
+    app = Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(True).build()
 
     # Register handlers
     app.add_handler(CommandHandler("start", start_command))
@@ -222,6 +286,8 @@ def main():
     app.add_handler(CommandHandler("price", price_command))
     app.add_error_handler(handle_error)
 
+    _RENDER_POOL = _new_render_pool()
+
     # Run with explicit event loop (fixes Python 3.14)
     print("✅ Bot is running! Send /flex <wallet> in your Telegram group.")
 
@@ -229,10 +295,24 @@ def main():
         async with app:
             await app.initialize()
             await app.start()
-            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            if WEBHOOK_URL:
+                await app.updater.start_webhook(
+                    listen="0.0.0.0",
+                    port=WEBHOOK_PORT,
+                    url_path=WEBHOOK_SECRET,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_SECRET}",
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            else:
+                await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
             # Keep running forever
-            while True:
-                await asyncio.sleep(3600)
+            try:
+                while True:
+                    await asyncio.sleep(3600)
+            finally:
+                await close_client()
+                _RENDER_POOL.shutdown(cancel_futures=True)
 
     asyncio.run(run())
 
@@ -1,22 +1,39 @@
 """
 Cyberpunk-styled $BERT Flex Card Generator v3.
-Features CyberBert mascot, no rank, high-res 2x rendering.
+Features CyberBert mascot, no rank, native-resolution rendering.
 """
 
 import os
 import math
-import random
+import logging
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache
 from io import BytesIO
+import numpy as np
+from cachetools import TTLCache
+import PIL
 from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageChops
 
 from config import (
     CARD_WIDTH, CARD_HEIGHT, TOKEN_TICKER, TOKEN_NAME,
 )
+from models import FlexCardData
 
-# ── Render at 2x then downscale ──
-SCALE = 2
-W = CARD_WIDTH * SCALE
-H = CARD_HEIGHT * SCALE
+logger = logging.getLogger(__name__)
+
+
+def log_pillow_build():
+    """Log which Pillow build renders cards (call once logging is configured)."""
+    # Pillow-SIMD (x86_64 AVX2 only) publishes versions like "9.5.0.post1"
+    if "post" in PIL.__version__:
+        logger.info(f"Using Pillow-SIMD {PIL.__version__}")
+    else:
+        logger.warning(f"Using stock Pillow {PIL.__version__}; install pillow-simd for faster rendering")
+
+# ── Render directly at card size ──
+W = CARD_WIDTH
+H = CARD_HEIGHT
 
 # ── Colors ──
 CYAN = (0, 240, 255)
@@ -33,9 +50,21 @@ LABEL_COLOR = (160, 160, 190)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 MASCOT_PATH = os.path.join(SCRIPT_DIR, "assets", "cyberbert.png")
 
+# ── Rendered card cache (flex_card_key -> JPEG bytes), kept in the calling process ──
+card_cache = TTLCache(maxsize=512, ttl=300)
+
+
+# ── Font path that loaded successfully, per style ──
+_RESOLVED = {}
+
 
+@lru_cache(maxsize=64)
 def _font(size, style="bold"):
     """Load fonts with extensive fallbacks for different environments."""
+    resolved = _RESOLVED.get(style)
+    if resolved:
+        return ImageFont.truetype(resolved, size)
+
     paths = {
         "bold": [
             "/usr/share/fonts/truetype/google-fonts/Poppins-Bold.ttf",
@@ -80,113 +109,102 @@ def _font(size, style="bold"):
     }
     for path in paths.get(style, paths["bold"]):
         try:
-            return ImageFont.truetype(path, size)
+            font = ImageFont.truetype(path, size)
         except (OSError, IOError):
             continue
+        _RESOLVED[style] = path
+        return font
     return ImageFont.load_default()
 
 
-def _glass_card(draw, bbox, accent_color, radius=16):
+def _glass_card(draw, bbox, accent_color, radius=8):
     """Glassmorphism card with accent border."""
     x0, y0, x1, y1 = [int(v) for v in bbox]
     draw.rounded_rectangle([x0, y0, x1, y1], radius=radius, fill=(15, 15, 30, 220))
-    draw.rounded_rectangle([x0, y0, x1, y1], radius=radius, outline=(*accent_color, 160), width=3)
-    draw.line([(x0 + radius, y0 + 2), (x1 - radius, y0 + 2)], fill=(*accent_color, 80), width=2)
+    draw.rounded_rectangle([x0, y0, x1, y1], radius=radius, outline=(*accent_color, 160), width=2)
+    draw.line([(x0 + radius, y0 + 1), (x1 - radius, y0 + 1)], fill=(*accent_color, 80), width=1)
 
 
-def _draw_bg(img, draw):
-    """Background grid, glow, particles."""
+def _build_static_bg():
+    """Background grid and corner glows, identical for every card."""
+    img = Image.new("RGBA", (W, H), (*BG_DARK, 255))
+    draw = ImageDraw.Draw(img)
+
     # Grid
-    for x in range(0, W, 60):
+    for x in range(0, W, 30):
         draw.line([(x, 0), (x, H)], fill=(20, 20, 40), width=1)
-    for y in range(0, H, 60):
+    for y in range(0, H, 30):
         draw.line([(0, y), (W, y)], fill=(20, 20, 40), width=1)
 
     # Corner glows
     glow = Image.new("RGBA", (W, H), (0, 0, 0, 0))
     gd = ImageDraw.Draw(glow)
-    for r in range(350, 0, -3):
-        a = int(14 * (r / 350))
+    for r in range(175, 0, -2):
+        a = int(14 * (r / 175))
         gd.ellipse([-r, -r, r, r], fill=(0, 240, 255, a))
-    for r in range(250, 0, -3):
-        a = int(10 * (r / 250))
+    for r in range(125, 0, -2):
+        a = int(10 * (r / 125))
         gd.ellipse([W - r, H - r, W + r, H + r], fill=(255, 0, 229, a))
-    img.paste(Image.alpha_composite(img, glow))
-
-    # Particles
-    for _ in range(35):
-        x = random.randint(0, W)
-        y = random.randint(0, H)
-        s = random.randint(2, 5)
-        a = random.randint(30, 100)
-        c = random.choice([(*CYAN, a), (*MAGENTA, a), (255, 255, 255, a)])
-        draw.ellipse([x, y, x + s, y + s], fill=c)
+    img = Image.alpha_composite(img, glow).convert("RGB")
 
-
-def _scanlines(img, opacity=8):
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    # Mascot sits behind all text
+    _place_mascot(img)
+    return img
+
+
+def _draw_particles(draw, wallet):
+    """Scatter floating neon particles (same layout for the same wallet)."""
+    rng = np.random.default_rng(zlib.crc32(wallet.encode()))
+    n = 35
+    xs = rng.integers(0, W + 1, n)
+    ys = rng.integers(0, H + 1, n)
+    sizes = rng.integers(1, 4, n)
+    alphas = rng.integers(30, 101, n)
+    colors = rng.integers(0, 3, n)
+    palette = (CYAN, MAGENTA, WHITE)
+    for x, y, s, a, c in zip(xs.tolist(), ys.tolist(), sizes.tolist(), alphas.tolist(), colors.tolist()):
+        draw.ellipse([x, y, x + s, y + s], fill=(*palette[c], a))
+
+
+def _scanline_overlay(size, opacity=8):
+    """CRT scanline layer, composited over the finished card."""
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
     d = ImageDraw.Draw(overlay)
-    for y in range(0, img.height, 4):
-        d.line([(0, y), (img.width, y)], fill=(0, 0, 0, opacity))
-    return Image.alpha_composite(img, overlay)
+    for y in range(0, size[1], 2):
+        d.line([(0, y), (size[0], y)], fill=(0, 0, 0, opacity))
+    return overlay
 
 
-def _gradient_bars(draw):
+def _gradient_bars(img):
     """Top and bottom neon gradient bars."""
-    for x in range(W):
-        ratio = x / W
-        r = int(CYAN[0] * (1 - ratio) + MAGENTA[0] * ratio)
-        g = int(CYAN[1] * (1 - ratio) + MAGENTA[1] * ratio)
-        b = int(CYAN[2] * (1 - ratio) + MAGENTA[2] * ratio)
-        draw.line([(x, 0), (x, 6)], fill=(r, g, b))
-    for x in range(W):
-        ratio = x / W
-        r = int(MAGENTA[0] * (1 - ratio) + CYAN[0] * ratio)
-        g = int(MAGENTA[1] * (1 - ratio) + CYAN[1] * ratio)
-        b = int(MAGENTA[2] * (1 - ratio) + CYAN[2] * ratio)
-        draw.line([(x, H - 6), (x, H)], fill=(r, g, b))
-
-
-def _neon_text(draw, pos, text, font, color, glow_radius=2):
-    x, y = pos
-    for dx in range(-glow_radius, glow_radius + 1):
-        for dy in range(-glow_radius, glow_radius + 1):
-            if dx == 0 and dy == 0:
-                continue
-            draw.text((x + dx, y + dy), text, font=font, fill=(*color, 35))
-    draw.text((x, y), text, font=font, fill=(*color, 255))
+    ramp = np.linspace(0, 1, W, endpoint=False, dtype=np.float32)[:, None]
+    rgb = (np.array(CYAN) * (1 - ramp) + np.array(MAGENTA) * ramp).astype(np.uint8)
+    bar = np.ascontiguousarray(np.broadcast_to(rgb, (3, W, 3)))
+    img.paste(Image.fromarray(bar), (0, 0))
+    img.paste(Image.fromarray(np.ascontiguousarray(bar[:, ::-1])), (0, H - 3))
 
 
-def _get_hands_label(duration_str):
-    if not duration_str or duration_str == "New holder":
-        return "NEW"
-    if "y" in duration_str:
-        return "OG DIAMOND"
-    if "m" in duration_str:
-        try:
-            months = int(duration_str.split("m")[0].strip())
-        except ValueError:
-            months = 0
-        if months >= 6: return "DIAMOND"
-        if months >= 3: return "STRONG"
-        return "STEADY"
-    return "FRESH"
+def _neon_text(img, draw, pos, text, font, color, glow_radius=2):
+    """Sharp text over a single Gaussian-blurred glow of itself."""
+    x, y = pos
+    pad = glow_radius * 3
+    left, top, right, bottom = draw.textbbox((x, y), text, font=font)
+    box = (int(left) - pad, int(top) - pad, int(right) + pad, int(bottom) + pad)
 
+    glow = Image.new("L", (box[2] - box[0], box[3] - box[1]), 0)
+    ImageDraw.Draw(glow).text((x - box[0], y - box[1]), text, font=font, fill=120)
+    glow = glow.filter(ImageFilter.GaussianBlur(glow_radius))
+    img.paste(color, box, glow)
 
-def _format_mcap(mcap):
-    if not mcap: return "N/A"
-    if mcap >= 1e9: return f"${mcap / 1e9:.1f}B"
-    if mcap >= 1e6: return f"${mcap / 1e6:.1f}M"
-    if mcap >= 1e3: return f"${mcap / 1e3:.1f}K"
-    return f"${mcap:.0f}"
+    draw.text((x, y), text, font=font, fill=(*color, 255))
 
 
-def _place_mascot(img):
-    """Place CyberBert on the right side with a gradient fade."""
+def _prepare_mascot():
+    """Load CyberBert, resize to card height and fade its left edge."""
     try:
         mascot = Image.open(MASCOT_PATH).convert("RGBA")
     except (FileNotFoundError, OSError):
-        return  # No mascot file, skip
+        return None  # No mascot file, skip
 
     # Target: fill right ~40% of card height, positioned bottom-right
     target_h = int(H * 0.85)
@@ -196,120 +214,150 @@ def _place_mascot(img):
     mascot = mascot.resize((target_w, target_h), Image.LANCZOS)
 
     # Create gradient alpha mask (fade on left edge)
-    mask = Image.new("L", (target_w, target_h), 255)
-    mask_draw = ImageDraw.Draw(mask)
     fade_width = int(target_w * 0.45)  # 45% fade zone
-    for x in range(fade_width):
-        alpha = int(255 * (x / fade_width))
-        mask_draw.line([(x, 0), (x, target_h)], fill=alpha)
+    row = np.full(target_w, 255, dtype=np.uint8)
+    row[:fade_width] = np.arange(fade_width) * 255 // fade_width
+    mask = Image.fromarray(np.ascontiguousarray(np.broadcast_to(row, (target_h, target_w))), "L")
 
     # Apply mask to mascot
     mascot.putalpha(Image.composite(mascot.split()[3], Image.new("L", mascot.size, 0), mask))
+    return mascot
+
+
+def _place_mascot(img):
+    """Place CyberBert on the right side with a gradient fade."""
+    if _MASCOT is None:
+        return
 
     # Position: right-aligned, vertically centered
-    paste_x = W - target_w + int(target_w * 0.08)  # slight overflow right
-    paste_y = (H - target_h) // 2
+    paste_x = W - _MASCOT.width + int(_MASCOT.width * 0.08)  # slight overflow right
+    paste_y = (H - _MASCOT.height) // 2
 
-    img.paste(mascot, (paste_x, paste_y), mascot)
+    img.paste(_MASCOT, (paste_x, paste_y), _MASCOT)
+
+
+# ── Static assets, built once per process ──
+_MASCOT = _prepare_mascot()
+_STATIC_BG = _build_static_bg()
+_SCANLINES = _scanline_overlay((W, H), opacity=4)
 
 
 # ══════════════════════════════════════
 #  MAIN GENERATOR
 # ══════════════════════════════════════
 
-def generate_flex_card(data: dict) -> BytesIO:
-    random.seed(hash(data.get("wallet", "")) % 2**32)
+def card_timestamp() -> str:
+    """Footer timestamp; minute resolution, so cards within a minute can share a render."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+def flex_card_key(data: FlexCardData, timestamp: str) -> tuple:
+    """Cache key covering everything drawn on the card."""
+    return (
+        data.wallet,
+        data.balance_str,
+        data.usd_str,
+        data.change_str,
+        data.hold_duration,
+        data.wallet_short,
+        data.mcap_str,
+        timestamp,
+    )
 
-    img = Image.new("RGBA", (W, H), (*BG_DARK, 255))
-    draw = ImageDraw.Draw(img)
 
-    # === Background ===
-    _draw_bg(img, draw)
-    draw = ImageDraw.Draw(img)
+def generate_flex_card(data: FlexCardData) -> bytes:
+    """Render a flex card in this process, reusing card_cache."""
+    timestamp = card_timestamp()
+    key = flex_card_key(data, timestamp)
+    card = card_cache.get(key)
+    if card is None:
+        card = render_flex_card(data, timestamp)
+        card_cache[key] = card
+    return card
 
-    # === Place mascot FIRST (behind text) ===
-    _place_mascot(img)
-    draw = ImageDraw.Draw(img)
 
-    _gradient_bars(draw)
+def render_flex_card(data: FlexCardData, timestamp: str) -> bytes:
+    """Render a flex card to JPEG bytes (uncached; safe to run in a worker process)."""
+    img = _STATIC_BG.copy()
+    draw = ImageDraw.Draw(img, "RGBA")
+
+    # === Background (grid, glows and mascot are prebuilt) ===
+    _draw_particles(draw, data.wallet)
+
+    _gradient_bars(img)
 
     # === Layout: text on left ~60% ===
-    px = 60
+    px = 30
     text_zone_w = int(W * 0.58)
 
     # ── HEADER ──
-    y = 50
+    y = 25
 
-    f_ticker = _font(56, "bold")
-    _neon_text(draw, (px, y), TOKEN_TICKER, f_ticker, CYAN, glow_radius=3)
+    f_ticker = _font(28, "bold")
+    _neon_text(img, draw, (px, y), TOKEN_TICKER, f_ticker, CYAN, glow_radius=2)
 
     # "FLEX CARD" badge
-    f_badge = _font(24, "medium")
+    f_badge = _font(12, "medium")
     badge_text = "FLEX CARD"
     badge_w = draw.textlength(badge_text, font=f_badge)
-    badge_x = text_zone_w - badge_w - 20
+    badge_x = text_zone_w - badge_w - 10
     draw.rounded_rectangle(
-        [badge_x - 15, y + 8, badge_x + badge_w + 15, y + 48],
-        radius=8, fill=(255, 0, 229, 30), outline=(*MAGENTA, 200), width=2,
+        [badge_x - 8, y + 4, badge_x + badge_w + 8, y + 24],
+        radius=4, fill=(255, 0, 229, 30), outline=(*MAGENTA, 200), width=1,
     )
-    draw.text((badge_x, y + 12), badge_text, font=f_badge, fill=MAGENTA)
+    draw.text((badge_x, y + 6), badge_text, font=f_badge, fill=MAGENTA)
 
-    y += 70
+    y += 35
 
     # Wallet address
-    f_wallet = _font(26, "mono")
-    wallet_short = data.get("wallet_short", "????...????")
-    draw.text((px, y), wallet_short, font=f_wallet, fill=DIM)
-    y += 50
+    f_wallet = _font(13, "mono")
+    draw.text((px, y), data.wallet_short, font=f_wallet, fill=DIM)
+    y += 25
 
     # Separator
-    draw.line([(px, y), (text_zone_w, y)], fill=(*CYAN, 50), width=2)
-    y += 25
+    draw.line([(px, y), (text_zone_w, y)], fill=(*CYAN, 50), width=1)
+    y += 12
 
     # ── BALANCE ──
-    f_label = _font(22, "medium")
+    f_label = _font(11, "medium")
     draw.text((px, y), "TOKEN BALANCE", font=f_label, fill=LABEL_COLOR)
-    y += 35
+    y += 18
 
-    f_balance = _font(72, "bold")
-    balance_str = data.get("balance_formatted", "0")
-    _neon_text(draw, (px, y), f"{balance_str} BERT", f_balance, WHITE, glow_radius=2)
-    y += 95
+    f_balance = _font(36, "bold")
+    _neon_text(img, draw, (px, y), f"{data.balance_str} BERT", f_balance, WHITE, glow_radius=1)
+    y += 47
 
     # USD value + 24h change
-    f_usd = _font(38, "bold")
-    usd_str = data.get("usd_value_formatted", "$0")
-    draw.text((px, y), f"~ {usd_str}", font=f_usd, fill=NEON_GREEN)
+    f_usd = _font(19, "bold")
+    usd_text = f"~ {data.usd_str}"
+    draw.text((px, y), usd_text, font=f_usd, fill=NEON_GREEN)
 
-    change = data.get("price_change_24h")
-    if change is not None:
-        change_color = NEON_GREEN if change >= 0 else RED
-        arrow = "+" if change >= 0 else ""
-        f_change = _font(26, "medium")
-        cx = px + draw.textlength(f"~ {usd_str}", font=f_usd) + 25
-        draw.text((cx, y + 10), f"{arrow}{change:.1f}% 24h", font=f_change, fill=change_color)
+    if data.change_str is not None:
+        f_change = _font(13, "medium")
+        cx = px + draw.textlength(usd_text, font=f_usd) + 12
+        draw.text((cx, y + 5), data.change_str, font=f_change, fill=NEON_GREEN if data.change_up else RED)
 
-    y += 70
+    y += 35
 
     # Separator
-    draw.line([(px, y), (text_zone_w, y)], fill=(*CYAN, 50), width=2)
-    y += 25
+    draw.line([(px, y), (text_zone_w, y)], fill=(*CYAN, 50), width=1)
+    y += 12
 
     # ── STAT CARDS (2 cards: Diamond Hands + Market Cap) ──
-    card_gap = 25
+    card_gap = 12
     card_w = (text_zone_w - px - card_gap) // 2
-    card_h = 175
+    card_h = 87
 
     cards = [
         {
             "label": "DIAMOND HANDS",
-            "value": data.get("hold_duration", "N/A"),
-            "sub": _get_hands_label(data.get("hold_duration", "")),
+            "value": data.hold_duration,
+            "sub": data.hands_label,
             "color": CYAN,
         },
         {
             "label": "MARKET CAP",
-            "value": _format_mcap(data.get("market_cap")),
+            "value": data.mcap_str,
             "sub": TOKEN_TICKER,
             "color": MAGENTA,
         },
@@ -317,54 +365,51 @@ def generate_flex_card(data: dict) -> BytesIO:
 
     for i, card in enumerate(cards):
         cx = px + i * (card_w + card_gap)
-        _glass_card(draw, (cx, y, cx + card_w, y + card_h), card["color"], radius=14)
+        _glass_card(draw, (cx, y, cx + card_w, y + card_h), card["color"], radius=7)
 
-        f_cl = _font(18, "medium")
-        draw.text((cx + 22, y + 16), card["label"], font=f_cl, fill=LABEL_COLOR)
+        f_cl = _font(9, "medium")
+        draw.text((cx + 11, y + 8), card["label"], font=f_cl, fill=LABEL_COLOR)
 
         val = card["value"]
-        f_val = _font(28 if len(val) > 14 else 36, "bold")
-        _neon_text(draw, (cx + 22, y + 55), val, f_val, card["color"], glow_radius=1)
+        f_val = _font(14 if len(val) > 14 else 18, "bold")
+        _neon_text(img, draw, (cx + 11, y + 27), val, f_val, card["color"], glow_radius=1)
 
         if card["sub"]:
-            f_sub = _font(18, "regular")
-            draw.text((cx + 22, y + card_h - 40), card["sub"], font=f_sub, fill=DIM)
+            f_sub = _font(9, "regular")
+            draw.text((cx + 11, y + card_h - 20), card["sub"], font=f_sub, fill=DIM)
 
     # ── FOOTER ──
-    footer_y = H - 55
-    f_footer = _font(20, "regular")
+    footer_y = H - 27
+    f_footer = _font(10, "regular")
     draw.text((px, footer_y), "www.bert.global  |  /flex your bag", font=f_footer, fill=DIM)
 
-    from datetime import datetime, timezone
-    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
-    ts_w = draw.textlength(now, font=f_footer)
-    draw.text((W - px - ts_w, footer_y), now, font=f_footer, fill=DIM)
+    ts_w = draw.textlength(timestamp, font=f_footer)
+    draw.text((W - px - ts_w, footer_y), timestamp, font=f_footer, fill=DIM)
 
     # === Post-processing ===
-    img = _scanlines(img, opacity=8)
-    img = img.resize((CARD_WIDTH, CARD_HEIGHT), Image.LANCZOS)
+    img.paste(_SCANLINES, (0, 0), _SCANLINES)
 
     buffer = BytesIO()
-    img.save(buffer, format="PNG", quality=95)
-    buffer.seek(0)
-    return buffer
+    img.save(buffer, format="JPEG", quality=90, optimize=False)
+    return buffer.getvalue()
 
 
 # ── Preview ──
 if __name__ == "__main__":
-    sample_data = {
-        "wallet": "5c1C2RRRqDmbbqjBxcv4fZuknqA2mF7WhX3eLCbxcv4f",
-        "wallet_short": "5c1C...bxcv",
-        "balance": 18_040_000,
-        "balance_formatted": "18.04M",
-        "price_usd": 0.0098,
-        "usd_value": 176_740,
-        "usd_value_formatted": "$176.74K",
-        "market_cap": 10_800_000,
-        "price_change_24h": 12.8,
-        "hold_duration": "5m 6d",
-    }
-    buf = generate_flex_card(sample_data)
-    with open("sample_flex_card.png", "wb") as f:
-        f.write(buf.read())
-    print("Sample card saved to sample_flex_card.png")
+    sample_data = FlexCardData(
+        wallet="5c1C2RRRqDmbbqjBxcv4fZuknqA2mF7WhX3eLCbxcv4f",
+        wallet_short="5c1C...bxcv",
+        balance=18_040_000,
+        usd_value=176_740,
+        balance_str="18.04M",
+        usd_str="$176.74K",
+        change_str="+12.8% 24h",
+        change_up=True,
+        hold_duration="5m 6d",
+        hands_label="STRONG",
+        mcap_str="$10.8M",
+    )
+    card = generate_flex_card(sample_data)
+    with open("sample_flex_card.jpg", "wb") as f:
+        f.write(card)
+    print("Sample card saved to sample_flex_card.jpg")
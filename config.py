@@ -10,6 +10,11 @@ load_dotenv()
 # Telegram
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 
+# Webhook (optional — leave WEBHOOK_URL empty to use long polling)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")        # Public https base URL, e.g. https://bert-bot.up.railway.app
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Required with WEBHOOK_URL; A-Z, a-z, 0-9, _ and - only
+
 # Solana
 SOLANA_RPC_URL = os.getenv("SOLANA_RPC_URL", "https://api.mainnet-beta.solana.com")
 
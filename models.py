@@ -0,0 +1,21 @@
+"""
+Shared data types for the $BERT Flex Bot.
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass(slots=True, frozen=True)
+class FlexCardData:
+    """Everything the flex card and caption show, pre-formatted once."""
+    wallet: str
+    wallet_short: str
+    balance: float | None
+    usd_value: float | None
+    balance_str: str
+    usd_str: str
+    change_str: str | None   # e.g. "+12.8% 24h"; None when price is unavailable
+    change_up: bool
+    hold_duration: str
+    hands_label: str
+    mcap_str: str
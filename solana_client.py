@@ -1,32 +1,61 @@
 """
 Solana on-chain data fetcher for $BERT token.
-Fetches token balance, price, holder rank, and first buy date.
+Fetches token balance, price, and first buy date for the flex card.
 """
 
 import httpx
 import base64
 import struct
 from datetime import datetime, timezone
+from cachetools import TTLCache
 from config import (
     SOLANA_RPC_URL, TOKEN_MINT, TOKEN_DECIMALS, DEXSCREENER_URL
 )
+from models import FlexCardData
 
 # SPL Token Program ID
 TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
 
+# Shared HTTP/2 client so RPC + DexScreener calls reuse pooled connections
+_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(30, connect=5),
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+)
+
+
+# First buy never changes once found; misses expire sooner so new holders show up.
+# Capped lookups (history longer than we page through) are only approximate.
+_first_buy_cache = TTLCache(maxsize=10_000, ttl=3600)
+_first_buy_provisional = TTLCache(maxsize=10_000, ttl=300)
+_first_buy_misses = TTLCache(maxsize=10_000, ttl=60)
+
+# getSignaturesForAddress paging: most token accounts fit in the small first page;
+# busier ones get one full-size page, which is at most one call more than fetching 1000
+SIGNATURES_FIRST_PAGE = 50
+SIGNATURES_PAGE = 1000
+SIGNATURES_MAX_PAGES = 2
+
+# DexScreener price is the same for every user
+_price_cache = TTLCache(maxsize=1, ttl=30)
+
+
+async def close_client():
+    """Close the shared HTTP client (call on shutdown)."""
+    await _CLIENT.aclose()
+
 
 async def _rpc_call(method: str, params: list) -> dict:
     """Make a JSON-RPC call to Solana."""
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(
-            SOLANA_RPC_URL,
-            json={"jsonrpc": "2.0", "id": 1, "method": method, "params": params},
-        )
-        return resp.json()
+    resp = await _CLIENT.post(
+        SOLANA_RPC_URL,
+        json={"jsonrpc": "2.0", "id": 1, "method": method, "params": params},
+    )
+    return resp.json()
 
 
-async def get_token_balance(wallet_address: str) -> float | None:
-    """Get the $BERT token balance for a wallet."""
+async def _get_token_accounts(wallet_address: str) -> list | None:
+    """Get the wallet's $BERT token accounts (jsonParsed)."""
     try:
         result = await _rpc_call(
             "getTokenAccountsByOwner",
@@ -36,26 +65,59 @@ async def get_token_balance(wallet_address: str) -> float | None:
                 {"encoding": "jsonParsed"},
             ],
         )
-        accounts = result.get("result", {}).get("value", [])
-        if not accounts:
-            return 0.0
-
-        total = 0.0
-        for acc in accounts:
-            info = acc["account"]["data"]["parsed"]["info"]["tokenAmount"]
-            total += float(info["uiAmount"] or 0)
-        return total
+        return result.get("result", {}).get("value", [])
     except Exception as e:
-        print(f"Error fetching balance: {e}")
+        print(f"Error fetching token accounts: {e}")
+        return None
+
+
+def _balance_from_accounts(accounts: list) -> float:
+    """Sum the UI balance across token accounts."""
+    total = 0.0
+    for acc in accounts:
+        info = acc["account"]["data"]["parsed"]["info"]["tokenAmount"]
+        total += float(info["uiAmount"] or 0)
+    return total
+
+
+def _first_buy_from_signatures(signatures: list) -> datetime | None:
+    """The last signature in the list is the oldest."""
+    if not signatures:
         return None
+    block_time = signatures[-1].get("blockTime")
+    if block_time:
+        return datetime.fromtimestamp(block_time, tz=timezone.utc)
+    return None
+
+
+def _lookup_first_buy(token_account: str) -> tuple[bool, datetime | None]:
+    """Return (hit, first_buy) from the first buy caches."""
+    for cache in (_first_buy_cache, _first_buy_provisional):
+        first_buy = cache.get(token_account)
+        if first_buy is not None:
+            return True, first_buy
+    if _first_buy_misses.get(token_account):
+        return True, None
+    return False, None
+
+
+def _store_first_buy(token_account: str, first_buy: datetime | None, final: bool = True):
+    if not first_buy:
+        _first_buy_misses[token_account] = True
+    elif final:
+        _first_buy_cache[token_account] = first_buy
+    else:
+        _first_buy_provisional[token_account] = first_buy
 
 
 async def get_token_price() -> dict | None:
     """Get current $BERT price and market data from DexScreener."""
+    cached = _price_cache.get(DEXSCREENER_URL)
+    if cached:
+        return cached
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.get(DEXSCREENER_URL)
-            data = resp.json()
+        resp = await _CLIENT.get(DEXSCREENER_URL, timeout=15)
+        data = resp.json()
 
         pairs = data.get("pairs", [])
         if not pairs:
@@ -63,138 +125,79 @@ async def get_token_price() -> dict | None:
 
         # Pick the pair with highest liquidity
         pair = max(pairs, key=lambda p: float(p.get("liquidity", {}).get("usd", 0)))
-        return {
+        price_data = {
             "price_usd": float(pair.get("priceUsd", 0)),
             "market_cap": float(pair.get("marketCap", 0) or pair.get("fdv", 0)),
             "price_change_24h": float(pair.get("priceChange", {}).get("h24", 0)),
             "volume_24h": float(pair.get("volume", {}).get("h24", 0)),
         }
+        _price_cache[DEXSCREENER_URL] = price_data
+        return price_data
     except Exception as e:
         print(f"Error fetching price: {e}")
         return None
 
 
-async def get_first_buy_timestamp(wallet_address: str) -> datetime | None:
+async def get_first_buy_timestamp(token_account: str) -> datetime | None:
     """
     Approximate the first time this wallet received $BERT tokens.
-    Uses getSignaturesForAddress on the token account.
+    Pages getSignaturesForAddress (newest first) on the wallet's token
+    account with `before` until the oldest signature is reached, or
+    SIGNATURES_MAX_PAGES is hit (then the result is only provisional).
     """
+    hit, first_buy = _lookup_first_buy(token_account)
+    if hit:
+        return first_buy
     try:
-        # First, find the token account address
-        result = await _rpc_call(
-            "getTokenAccountsByOwner",
-            [
-                wallet_address,
-                {"mint": TOKEN_MINT},
-                {"encoding": "jsonParsed"},
-            ],
-        )
-        accounts = result.get("result", {}).get("value", [])
-        if not accounts:
-            return None
-
-        token_account = accounts[0]["pubkey"]
-
-        # Get the oldest signatures for this token account
-        sigs_result = await _rpc_call(
-            "getSignaturesForAddress",
-            [
-                token_account,
-                {"limit": 1000},  # Get as many as we can
-            ],
-        )
-        signatures = sigs_result.get("result", [])
-        if not signatures:
-            return None
-
-        # The last signature in the list is the oldest
-        oldest = signatures[-1]
-        block_time = oldest.get("blockTime")
-        if block_time:
-            return datetime.fromtimestamp(block_time, tz=timezone.utc)
-        return None
+        oldest_page = []
+        complete = False
+        options = {"limit": SIGNATURES_FIRST_PAGE, "commitment": "finalized"}
+        for _ in range(SIGNATURES_MAX_PAGES):
+            sigs_result = await _rpc_call("getSignaturesForAddress", [token_account, options])
+            if "result" not in sigs_result:
+                print(f"Error fetching first buy: {sigs_result.get('error')}")
+                return None
+            page = sigs_result["result"]
+            if page:
+                oldest_page = page
+            if len(page) < options["limit"]:
+                complete = True
+                break
+            options = {
+                "limit": SIGNATURES_PAGE,
+                "commitment": "finalized",
+                "before": page[-1]["signature"],
+            }
+
+        first_buy = _first_buy_from_signatures(oldest_page)
+        _store_first_buy(token_account, first_buy, final=complete)
+        return first_buy
     except Exception as e:
         print(f"Error fetching first buy: {e}")
         return None
 
 
-async def get_holder_rank(wallet_address: str) -> dict | None:
-    """
-    Get approximate holder rank using DexScreener or Birdeye data.
-    Falls back to a simulated rank based on balance percentile.
-    """
-    try:
-        # Use Helius DAS API or fallback
-        # For now, we'll use a simple approach: fetch top holders
-        # via the getTokenLargestAccounts RPC method
-        result = await _rpc_call("getTokenLargestAccounts", [TOKEN_MINT])
-        largest = result.get("result", {}).get("value", [])
-
-        if not largest:
-            return None
-
-        # Check if our wallet's token account is in top 20
-        accounts_result = await _rpc_call(
-            "getTokenAccountsByOwner",
-            [
-                wallet_address,
-                {"mint": TOKEN_MINT},
-                {"encoding": "jsonParsed"},
-            ],
-        )
-        user_accounts = accounts_result.get("result", {}).get("value", [])
-        if not user_accounts:
-            return {"rank": None, "total_holders": len(largest), "top_20": False}
-
-        user_pubkey = user_accounts[0]["pubkey"]
-        user_balance = float(
-            user_accounts[0]["account"]["data"]["parsed"]["info"]["tokenAmount"]["uiAmount"] or 0
-        )
-
-        # Check rank among largest holders
-        for i, holder in enumerate(largest):
-            if holder["address"] == user_pubkey:
-                return {
-                    "rank": i + 1,
-                    "total_holders": "20+",
-                    "top_20": True,
-                }
-
-        # Not in top 20 — estimate rank based on balance comparison
-        if largest:
-            smallest_top = float(largest[-1]["uiAmount"] or 0)
-            if user_balance > 0 and smallest_top > 0:
-                ratio = user_balance / smallest_top
-                if ratio > 0.5:
-                    est_rank = 20 + int((1 - ratio) * 30)
-                elif ratio > 0.1:
-                    est_rank = 50 + int((1 - ratio) * 200)
-                else:
-                    est_rank = 250 + int((1 - ratio) * 1000)
-                return {
-                    "rank": est_rank,
-                    "total_holders": "est.",
-                    "top_20": False,
-                }
-
-        return {"rank": None, "total_holders": "unknown", "top_20": False}
-
-    except Exception as e:
-        print(f"Error fetching holder rank: {e}")
-        return None
-
-
-async def get_wallet_data(wallet_address: str) -> dict:
+async def get_wallet_data(wallet_address: str) -> FlexCardData:
     """Fetch all data needed for the flex card."""
     import asyncio
 
-    balance, price_data, first_buy, rank_data = await asyncio.gather(
-        get_token_balance(wallet_address),
+    # Token accounts are looked up once; the account pubkey feeds the other lookups
+    accounts, price_data = await asyncio.gather(
+        _get_token_accounts(wallet_address),
         get_token_price(),
-        get_first_buy_timestamp(wallet_address),
-        get_holder_rank(wallet_address),
     )
 
+    balance = None
+    if accounts is not None:
+        try:
+            balance = _balance_from_accounts(accounts)
+        except Exception as e:
+            print(f"Error fetching balance: {e}")
+
+    first_buy = None
+    if accounts:
+        first_buy = await get_first_buy_timestamp(accounts[0]["pubkey"])
+
     usd_value = None
     if balance is not None and price_data:
         usd_value = balance * price_data["price_usd"]
@@ -211,22 +214,22 @@ async def get_wallet_data(wallet_address: str) -> dict:
         else:
             hold_duration = f"{days}d {delta.seconds // 3600}h"
 
-    return {
-        "wallet": wallet_address,
-        "wallet_short": f"{wallet_address[:4]}...{wallet_address[-4:]}",
-        "balance": balance,
-        "balance_formatted": _format_number(balance) if balance else "0",
-        "price_usd": price_data["price_usd"] if price_data else None,
-        "usd_value": usd_value,
-        "usd_value_formatted": _format_usd(usd_value) if usd_value else "$0",
-        "market_cap": price_data.get("market_cap") if price_data else None,
-        "price_change_24h": price_data.get("price_change_24h") if price_data else None,
-        "first_buy": first_buy,
-        "hold_duration": hold_duration or "New holder",
-        "rank": rank_data.get("rank") if rank_data else None,
-        "rank_display": _format_rank(rank_data) if rank_data else "Unranked",
-        "top_20": rank_data.get("top_20", False) if rank_data else False,
-    }
+    change = price_data.get("price_change_24h") if price_data else None
+    hold_duration = hold_duration or "New holder"
+
+    return FlexCardData(
+        wallet=wallet_address,
+        wallet_short=f"{wallet_address[:4]}...{wallet_address[-4:]}",
+        balance=balance,
+        usd_value=usd_value,
+        balance_str=_format_number(balance) if balance else "0",
+        usd_str=_format_usd(usd_value) if usd_value else "$0",
+        change_str=f"{'+' if change >= 0 else ''}{change:.1f}% 24h" if change is not None else None,
+        change_up=change is None or change >= 0,
+        hold_duration=hold_duration,
+        hands_label=_get_hands_label(hold_duration),
+        mcap_str=_format_mcap(price_data.get("market_cap") if price_data else None),
+    )
 
 
 def _format_number(n: float) -> str:
@@ -255,15 +258,27 @@ def _format_usd(n: float) -> str:
     return f"${n:.4f}"
 
 
-def _format_rank(rank_data: dict) -> str:
-    """Format holder rank display."""
-    if not rank_data or rank_data.get("rank") is None:
-        return "Unranked"
-    rank = rank_data["rank"]
-    if rank <= 10:
-        return f"🐋 #{rank} (Top 10)"
-    if rank <= 50:
-        return f"🦈 #{rank} (Top 50)"
-    if rank <= 100:
-        return f"🐬 #{rank} (Top 100)"
-    return f"🐟 ~#{rank}"
+def _format_mcap(mcap: float | None) -> str:
+    """Format market cap for the stat card."""
+    if not mcap: return "N/A"
+    if mcap >= 1e9: return f"${mcap / 1e9:.1f}B"
+    if mcap >= 1e6: return f"${mcap / 1e6:.1f}M"
+    if mcap >= 1e3: return f"${mcap / 1e3:.1f}K"
+    return f"${mcap:.0f}"
+
+
+def _get_hands_label(duration_str: str) -> str:
+    """Diamond hands tier for a hold duration string."""
+    if not duration_str or duration_str == "New holder":
+        return "NEW"
+    if "y" in duration_str:
+        return "OG DIAMOND"
+    if "m" in duration_str:
+        try:
+            months = int(duration_str.split("m")[0].strip())
+        except ValueError:
+            months = 0
+        if months >= 6: return "DIAMOND"
+        if months >= 3: return "STRONG"
+        return "STEADY"
+    return "FRESH"